@@ -1,6 +1,10 @@
+import heapq
+import mmap
 import os
-from typing import List, Optional, Tuple
-from collections import defaultdict
+import struct
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from decimal import Decimal
 from datetime import datetime
 
@@ -9,138 +13,376 @@ from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
 
 
 
+# Закрывает отображения и дескрипторы файлов данных и обрезает незаполненный хвост,
+# чтобы на диске оставались только записи. Вызывается из close() или при сборке мусора
+def _release_files(fds: Dict[str, int], mms: Dict[str, Optional[mmap.mmap]],
+                   counts: Optional[Dict[str, int]], record_size: int):
+    for mm in mms.values():
+        if mm is not None:
+            mm.flush()
+            mm.close()
+    for file_path, fd in fds.items():
+        if counts is not None:
+            os.ftruncate(fd, counts[file_path] * record_size)
+        os.close(fd)
+    mms.clear()
+    fds.clear()
+
+
 class CarService:
     RECORD_SIZE = 500
     RECORD_SIZE_WITH_NL = 501
+    # Файл данных растёт кусками по столько записей; хвост куска заполнен нулевыми байтами
+    GROW_RECORDS = 256
+    # Запись индекса: ключ фиксированной длины (дополняется нулями) + позиция
+    INDEX_KEY_SIZE = 32
+    INDEX_ENTRY = struct.Struct(f'<{INDEX_KEY_SIZE}sQ')
+    # Сколько записей индекса копится в памяти внутри batch(), прежде чем они будут дописаны в файл
+    INDEX_BUFFER_LIMIT = 1000
+    # Поля машины лежат по фиксированным смещениям, запись разбирается срезами без split
+    CAR_VIN = slice(0, 17)
+    CAR_MODEL = slice(17, 27)
+    CAR_PRICE = slice(27, 47)
+    CAR_DATE = slice(47, 79)
+    CAR_STATUS = slice(79, 89)
+    CAR_LAYOUT = (CAR_VIN, CAR_MODEL, CAR_PRICE, CAR_DATE, CAR_STATUS)
+    # Поля продажи
+    SALE_NUMBER = slice(0, 32)
+    SALE_VIN = slice(32, 49)
+    SALE_COST = slice(49, 69)
+    SALE_DATE = slice(69, 101)
+    SALE_DELETED = slice(101, 106)
+    SALE_LAYOUT = (SALE_NUMBER, SALE_VIN, SALE_COST, SALE_DATE, SALE_DELETED)
     
     def __init__(self, root_directory_path: str) -> None:
         self.root_directory_path = root_directory_path
         os.makedirs(root_directory_path, exist_ok=True)
         
         # Модели
+        # Индекс моделям не нужен: справочник целиком читается из models.txt при старте
         self.models_file = os.path.join(root_directory_path, 'models.txt')
-        self.models_index_file = os.path.join(root_directory_path, 'models_index.txt')
         
         # Автомобили
         self.cars_file = os.path.join(root_directory_path, 'cars.txt')
-        self.cars_index_file = os.path.join(root_directory_path, 'cars_index.txt')
+        self.cars_index_file = os.path.join(root_directory_path, 'cars_index.idx')
         
         # Продажи
         self.sales_file = os.path.join(root_directory_path, 'sales.txt')
-        self.sales_index_file = os.path.join(root_directory_path, 'sales_index.txt')
+        self.sales_index_file = os.path.join(root_directory_path, 'sales_index.idx')
         
+        self._check_legacy_indexes()
         self._init_files() # Это метод, который создаёт пустые файлы, если их нет.
 
+        # Индексы в памяти: ключ -> позиция. Загружаются с диска при первом обращении.
+        self._cars_idx: Optional[Dict[str, int]] = None
+        self._sales_idx: Optional[Dict[str, int]] = None
+        # VIN -> позиция действующей (не отменённой) продажи
+        self._active_sale_by_vin: Optional[Dict[str, int]] = None
+        # Вторичный индекс: статус -> позиции машин в cars.txt
+        self._cars_by_status: Optional[Dict[str, Set[int]]] = None
+        # Позиции действующих продаж в sales.txt по id модели
+        self._model_sales: Optional[Dict[str, Set[int]]] = None
+        # Записи индексов, ещё не дописанные на диск: индексный файл -> упакованные записи
+        self._idx_buffer: Dict[str, List[bytes]] = {}
+        # Глубина вложенности batch(): пока она больше нуля, записи индексов копятся в памяти
+        self._batch_depth = 0
+
+        # Файлы данных открываются и отображаются в память один раз на весь срок жизни сервиса
+        self._fds: Dict[str, int] = {}
+        self._mms: Dict[str, Optional[mmap.mmap]] = {}
+        for file_path in [self.models_file, self.cars_file, self.sales_file]:
+            fd = os.open(file_path, os.O_RDWR)
+            self._fds[file_path] = fd
+            self._mms[file_path] = self._map_file(fd)
+
+        # Количество записей в файлах данных, дальше увеличивается при каждой вставке
+        self._counts: Dict[str, int] = {
+            file_path: self._count_records(mm) for file_path, mm in self._mms.items()
+        }
+        try:
+            self._check_record_layout()
+        except ValueError:
+            # Файлы чужого формата закрываются как есть, без обрезки
+            _release_files(self._fds, self._mms, None, self.RECORD_SIZE_WITH_NL)
+            raise
+        # Файлы освобождаются и для сервиса, у которого так и не вызвали close()
+        self._finalizer = weakref.finalize(
+            self, _release_files, self._fds, self._mms, self._counts, self.RECORD_SIZE_WITH_NL
+        )
+
+        # Справочник моделей небольшой, поэтому целиком держится в памяти: id -> (название, бренд)
+        self._models: Dict[str, Tuple[str, str]] = self._load_all_models()
+
+
+    # Старые текстовые индексы "ключ:позиция" не читаются, такое хранилище нужно пересоздать
+    def _check_legacy_indexes(self):
+        for name in ['models_index.txt', 'cars_index.txt', 'sales_index.txt']:
+            if os.path.exists(os.path.join(self.root_directory_path, name)):
+                raise ValueError(
+                    f"Storage {self.root_directory_path} uses the old text index format ({name}) "
+                    "and is not supported"
+                )
+
+    # Записи машин и продаж раньше разделялись "|", по фиксированным смещениям такие записи не читаются
+    def _check_record_layout(self):
+        if self._counts[self.cars_file]:
+            status = self._read_record(self.cars_file, 0)[self.CAR_STATUS].rstrip()
+            if status not in {car_status.value for car_status in CarStatus}:
+                raise ValueError(f"Storage {self.root_directory_path} uses an unsupported cars.txt layout")
+        if self._counts[self.sales_file]:
+            deleted = self._read_record(self.sales_file, 0)[self.SALE_DELETED].rstrip()
+            if deleted not in ('True', 'False'):
+                raise ValueError(f"Storage {self.root_directory_path} uses an unsupported sales.txt layout")
 
     def _init_files(self):
-        for file_path in [self.models_file, self.models_index_file, # Просто проверяет наличие всех 6 файлов.
+        for file_path in [self.models_file, # Просто проверяет наличие всех 5 файлов.
                          self.cars_file, self.cars_index_file,
                          self.sales_file, self.sales_index_file]:
             if not os.path.exists(file_path):
                 with open(file_path, 'w') as f:
                     pass
-        
 
-    def _format_record(self, data: str) -> str: # Выравнивает запись (data) до 500 символов, заполняя пробелами справа.
-        return data.ljust(self.RECORD_SIZE) + '\n'
-
-
-    # Считывает индексный файл строками, каждая строка имеет формат "ключ:позиция"
+    # Пустой файл отобразить в память нельзя, для него mmap создаётся при первой записи
+    def _map_file(self, fd: int) -> Optional[mmap.mmap]:
+        if os.fstat(fd).st_size == 0:
+            return None
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE)
+
+    # Записанные записи заканчиваются переводом строки, незаполненный хвост файла - нулевыми байтами.
+    # После close() хвоста нет, он остаётся только если процесс завершился аварийно
+    def _count_records(self, mm: Optional[mmap.mmap]) -> int:
+        if mm is None:
+            return 0
+        count = len(mm) // self.RECORD_SIZE_WITH_NL
+        while count and mm[count * self.RECORD_SIZE_WITH_NL - 1] != ord('\n'):
+            count -= 1
+        return count
+
+    # Дописывает накопленные записи индексов, по одной записи в каждый файл
+    def commit(self):
+        for index_file, entries in self._idx_buffer.items():
+            if entries:
+                with open(index_file, 'ab') as f:
+                    f.write(b''.join(entries))
+        self._idx_buffer.clear()
+
+    # Группирует вставки: записи индексов дописываются на диск одним разом при выходе из блока
+    @contextmanager
+    def batch(self) -> Iterator["CarService"]:
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.commit()
+
+    # Сброс данных на диск и закрытие всех файлов
+    def close(self):
+        self.commit()
+        self._finalizer()
+
+    def __enter__(self) -> "CarService":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+        
+
+    def _format_record_bytes(self, data: str) -> bytes: # Выравнивает запись (data) до 500 байт, заполняя пробелами справа.
+        encoded = data.encode('utf-8')
+        if len(encoded) > self.RECORD_SIZE:
+            raise ValueError(f"Record is longer than {self.RECORD_SIZE} bytes")
+        return encoded.ljust(self.RECORD_SIZE, b' ') + b'\n'
+
+    # Собирает запись из полей, каждое поле дополняется пробелами до своей ширины
+    def _pack_fields(self, values: List[str], layout: Tuple[slice, ...]) -> str:
+        parts = []
+        for value, field in zip(values, layout):
+            width = field.stop - field.start
+            if len(value) > width:
+                raise ValueError(f"Value {value} is longer than {width} characters")
+            parts.append(value.ljust(width))
+        return ''.join(parts)
+
+    def _unpack_fields(self, record: str, layout: Tuple[slice, ...]) -> List[str]:
+        return [record[field].rstrip() for field in layout]
+
+
+    # Считывает индексный файл из записей фиксированной длины "ключ + позиция"
     def _load_index(self, index_file: str) -> List[Tuple[str, int]]: 
         if not os.path.exists(index_file):
             return []
-        with open(index_file, 'r') as f:
-            lines = f.readlines()
-        index = []
-        for line in lines:
-            if ':' in line:
-                key, pos_str = line.strip().split(':', 1)
-                index.append((key, int(pos_str)))
-        return sorted(index, key=lambda x: x[0])
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        if len(data) % self.INDEX_ENTRY.size:
+            raise ValueError(f"Index file {index_file} is corrupted")
+        return [
+            (key.rstrip(b'\0').decode('utf-8'), pos)
+            for key, pos in self.INDEX_ENTRY.iter_unpack(data)
+        ]
+
+    def _pack_index_entry(self, key: str, pos: int) -> bytes:
+        key_bytes = key.encode('utf-8')
+        if len(key_bytes) > self.INDEX_KEY_SIZE:
+            raise ValueError(f"Key {key} is longer than {self.INDEX_KEY_SIZE} bytes")
+        return self.INDEX_ENTRY.pack(key_bytes, pos)
+
+    # Индекс читается с диска один раз и дальше хранится в self.<attr>
+    def _load_index_cached(self, attr: str, index_file: str) -> Dict[str, int]:
+        index = getattr(self, attr)
+        if index is None:
+            index = dict(self._load_index(index_file))
+            setattr(self, attr, index)
+        return index
 
     # Сохранение индекса
-    def _save_index(self, index: List[Tuple[str, int]], index_file: str):
-        with open(index_file, 'w') as f:
-            for key, pos in index:
-                f.write(f"{key}:{pos}\n")
-
-    # Запись данных
-    def _write_record(self, file_path: str, position: int, record: str):
-        with open(file_path, 'r+') as f:
-            f.seek(position * self.RECORD_SIZE_WITH_NL) 
-            f.write(record)
+    def _save_index(self, index: Dict[str, int], index_file: str):
+        # Индекс в памяти уже содержит все накопленные записи
+        self._idx_buffer.pop(index_file, None)
+        with open(index_file, 'wb') as f:
+            f.write(b''.join(self._pack_index_entry(key, pos) for key, pos in index.items()))
+
+    # Дописывает записи в конец индексного файла; внутри batch() они откладываются до commit()
+    def _append_index(self, index_file: str, entries: List[Tuple[str, int]]):
+        buffer = self._idx_buffer.setdefault(index_file, [])
+        buffer.extend(self._pack_index_entry(key, pos) for key, pos in entries)
+        if not self._batch_depth or len(buffer) >= self.INDEX_BUFFER_LIMIT:
+            self.commit()
+
+    # Запись данных: срез mmap. При записи за конец файл увеличивается кусками и отображается заново,
+    # mmap.resize() не используется, потому что без mremap() (macOS) он недоступен
+    def _write_record(self, file_path: str, position: int, data: bytes):
+        offset = position * self.RECORD_SIZE_WITH_NL
+        end = offset + len(data)
+        mm = self._mms[file_path]
+        if mm is None or end > len(mm):
+            if mm is not None:
+                mm.close()
+            chunk = self.GROW_RECORDS * self.RECORD_SIZE_WITH_NL
+            fd = self._fds[file_path]
+            os.ftruncate(fd, max((end + chunk - 1) // chunk * chunk, os.fstat(fd).st_size))
+            mm = self._mms[file_path] = self._map_file(fd)
+        mm[offset:end] = data
 
     # Чтение данных
     def _read_record(self, file_path: str, position: int) -> str: 
-        with open(file_path, 'r') as f:
-            f.seek(position * self.RECORD_SIZE_WITH_NL)
-            return f.read(self.RECORD_SIZE).rstrip()
-
-    # Поиск свободной позиции
-    def _find_free_position(self, data_file: str) -> int:
-        size = os.path.getsize(data_file)
-        return size // self.RECORD_SIZE_WITH_NL
+        mm = self._mms[file_path]
+        if mm is None:
+            return ''
+        offset = position * self.RECORD_SIZE_WITH_NL
+        return mm[offset:offset + self.RECORD_SIZE].decode('utf-8').rstrip()
+
+    # Последовательный проход по всем записям файла за одно чтение
+    def _iter_records(self, file_path: str) -> Iterator[str]:
+        mm = self._mms[file_path]
+        if mm is None:
+            return
+        data = mm[:self._counts[file_path] * self.RECORD_SIZE_WITH_NL]
+        for offset in range(0, len(data), self.RECORD_SIZE_WITH_NL):
+            yield data[offset:offset + self.RECORD_SIZE].decode('utf-8').rstrip()
+
+    # Дописывает пачку записей в конец файла данных, возвращает позицию первой из них
+    def _append_records(self, file_path: str, records: List[bytes]) -> int:
+        position = self._counts[file_path]
+        if records:
+            self._write_record(file_path, position, b''.join(records))
+            self._counts[file_path] = position + len(records)
+        return position
 
     # Сохранение автомобилей и моделей
     def add_model(self, model: Model) -> Model:
-        model_data = f"{model.id}|{model.name}|{model.brand}"
-        formatted = self._format_record(model_data)
-        position = self._find_free_position(self.models_file)
-        self._write_record(self.models_file, position, formatted)
-        
-        index = self._load_index(self.models_index_file)
-        index.append((str(model.id), position))
-        index.sort(key=lambda x: x[0])
-        self._save_index(index, self.models_index_file)
-        return model
+        return self.add_models([model])[0]
+
+
+    def add_models(self, models: Iterable[Model]) -> List[Model]:
+        models = list(models)
+        self._append_records(self.models_file, [
+            self._format_record_bytes(f"{model.id}|{model.name}|{model.brand}")
+            for model in models
+        ])
+
+        self._models.update((str(model.id), (model.name, model.brand)) for model in models)
+        return models
 
 
     def add_car(self, car: Car) -> Car:
-        car_data = f"{car.vin}|{car.model}|{car.price}|{car.date_start.isoformat()}|{car.status.value}"
-        formatted = self._format_record(car_data)
-        position = self._find_free_position(self.cars_file)
-        self._write_record(self.cars_file, position, formatted)
-        
-        index = self._load_index(self.cars_index_file)
-        index.append((car.vin, position))
-        index.sort(key=lambda x: x[0])
-        self._save_index(index, self.cars_index_file)
-        return car
+        return self.add_cars([car])[0]
+
+
+    def add_cars(self, cars: Iterable[Car]) -> List[Car]:
+        cars = list(cars)
+        position = self._append_records(self.cars_file, [
+            self._format_record_bytes(self._pack_fields(
+                [car.vin, str(car.model), str(car.price), car.date_start.isoformat(), car.status.value],
+                self.CAR_LAYOUT
+            ))
+            for car in cars
+        ])
+
+        entries = [(car.vin, position + i) for i, car in enumerate(cars)]
+        self._load_index_cached('_cars_idx', self.cars_index_file).update(entries)
+        cars_by_status = self._load_cars_by_status()
+        for i, car in enumerate(cars):
+            cars_by_status.setdefault(car.status.value, set()).add(position + i)
+        self._append_index(self.cars_index_file, entries)
+        return cars
 
     #  Сохранение продаж
     def sell_car(self, sale: Sale) -> Car:
-        sale_data = f"{sale.sales_number}|{sale.car_vin}|{sale.cost}|{sale.sales_date.isoformat()}|False"
-        formatted = self._format_record(sale_data)
-        position = self._find_free_position(self.sales_file)
-        self._write_record(self.sales_file, position, formatted)
-        
-        index = self._load_index(self.sales_index_file)
-        index.append((sale.sales_number, position))
-        index.sort(key=lambda x: x[0])
-        self._save_index(index, self.sales_index_file)
-        
-        self._update_car_status(sale.car_vin, CarStatus.sold.value)
-        return self._get_car_by_vin(sale.car_vin)
+        return self.sell_cars([sale])[0]
+
+
+    def sell_cars(self, sales: Iterable[Sale]) -> List[Car]:
+        sales = list(sales)
+        # Все машины проверяются до записи, чтобы пачка не применилась наполовину
+        cars_index = self._load_index_cached('_cars_idx', self.cars_index_file)
+        for sale in sales:
+            if sale.car_vin not in cars_index:
+                raise ValueError(f"Car {sale.car_vin} not found")
+        model_sales = self._load_model_sales()
+        position = self._append_records(self.sales_file, [
+            self._format_record_bytes(self._pack_fields(
+                [sale.sales_number, sale.car_vin, str(sale.cost), sale.sales_date.isoformat(), 'False'],
+                self.SALE_LAYOUT
+            ))
+            for sale in sales
+        ])
+
+        entries = [(sale.sales_number, position + i) for i, sale in enumerate(sales)]
+        self._load_index_cached('_sales_idx', self.sales_index_file).update(entries)
+        self._append_index(self.sales_index_file, entries)
+        active_sales = self._load_active_sales()
+        for i, sale in enumerate(sales):
+            active_sales.setdefault(sale.car_vin, position + i)
+
+        for sale in sales:
+            self._update_car_status(sale.car_vin, CarStatus.sold.value)
+        cars = [self._get_car_by_vin(sale.car_vin) for sale in sales]
+        for i, car in enumerate(cars):
+            model_sales.setdefault(str(car.model), set()).add(position + i)
+        return cars
 
     # Чтение списка машин
     def get_cars(self, status: CarStatus) -> List[Car]:
+        # Локальные ссылки, чтобы в цикле не искать их заново на каждой записи
+        read_record = self._read_record
+        construct = Car.model_construct
+        fromisoformat = datetime.fromisoformat
+        to_decimal = Decimal
+        cars_file = self.cars_file
+        vin_field, model_field, price_field, date_field = self.CAR_LAYOUT[:4]
+
         cars = []
-        file_size = os.path.getsize(self.cars_file)
-        if file_size == 0:
-            return []
-        total_records = file_size // self.RECORD_SIZE_WITH_NL
-        for pos in range(total_records):
-            record = self._read_record(self.cars_file, pos)
-            if record.strip():  
-                fields = record.split('|', 4)
-                if len(fields) == 5 and fields[4].strip() == status.value:
-                    cars.append(Car.model_validate({
-                        'vin': fields[0].strip(),
-                        'model': fields[1].strip(),
-                        'price': fields[2].strip(),
-                        'date_start': fields[3].strip(),
-                        'status': fields[4].strip()
-                    }))
+        for pos in sorted(self._load_cars_by_status().get(status.value, ())):
+            record = read_record(cars_file, pos)
+            cars.append(construct(
+                vin=record[vin_field].rstrip(),
+                model=int(record[model_field]),
+                price=to_decimal(record[price_field].rstrip()),
+                date_start=fromisoformat(record[date_field].rstrip()),
+                status=status
+            ))
         return cars  
 
     # Вывод детальной информации
@@ -149,138 +391,94 @@ class CarService:
         if not car_data:
             return None
         
-        fields = car_data.split('|', 4)
-        if len(fields) != 5:
-            return None
-        
-        car_vin, model_id, price_str, date_str, status_str = [f.strip() for f in fields]
+        car_vin, model_id, price_str, date_str, status_str = self._unpack_fields(car_data, self.CAR_LAYOUT)
         
         model_data = self._find_model_by_id(model_id)
         if not model_data:
             return None
         
-        m_fields = model_data.split('|', 2)
-        if len(m_fields) != 3:
-            return None
-        
-        _, model_name, brand = [f.strip() for f in m_fields]
+        model_name, brand = model_data
         
         sales_date = sales_cost = None
         if status_str == CarStatus.sold.value:
             sale_data = self._find_active_sale_by_vin(car_vin)
             if sale_data:
-                s_fields = sale_data.split('|', 4)
-                if len(s_fields) == 5:
-                    _, _, cost_str, date_s_str, _ = [f.strip() for f in s_fields]
-                    sales_date = datetime.fromisoformat(date_s_str)
-                    sales_cost = Decimal(cost_str)
-        
-        return CarFullInfo.model_validate({
-            'vin': car_vin,
-            'car_model_name': model_name,
-            'car_model_brand': brand,
-            'price': price_str,
-            'date_start': date_str,
-            'status': status_str,
-            'sales_date': sales_date,
-            'sales_cost': sales_cost
-        })
+                sales_date = datetime.fromisoformat(sale_data[self.SALE_DATE].rstrip())
+                sales_cost = Decimal(sale_data[self.SALE_COST].rstrip())
+        
+        return CarFullInfo.model_construct(
+            vin=car_vin,
+            car_model_name=model_name,
+            car_model_brand=brand,
+            price=Decimal(price_str),
+            date_start=datetime.fromisoformat(date_str),
+            status=CarStatus(status_str),
+            sales_date=sales_date,
+            sales_cost=sales_cost
+        )
 
     # Обновление ключевого поля
     def update_vin(self, vin: str, new_vin: str) -> Car:
-        cars_index = self._load_index(self.cars_index_file)
-        position = None
-        index_entry = None
-        
-        for i, (idx_vin, pos) in enumerate(cars_index):
-            if idx_vin == vin:
-                position = pos
-                index_entry = i
-                break
-        
+        cars_index = self._load_index_cached('_cars_idx', self.cars_index_file)
+        position = cars_index.get(vin)
         if position is None:
             raise ValueError(f"Car {vin} not found")
         
-        record = self._read_record(self.cars_file, position)
-        fields = record.split('|', 4)
-        if len(fields) == 5:
-            fields[0] = new_vin
-            self._write_record(self.cars_file, position, self._format_record('|'.join(fields)))
+        fields = self._unpack_fields(self._read_record(self.cars_file, position), self.CAR_LAYOUT)
+        fields[0] = new_vin
+        self._write_record(self.cars_file, position, self._format_record_bytes(self._pack_fields(fields, self.CAR_LAYOUT)))
         
-        cars_index[index_entry] = (new_vin, position)
-        cars_index.sort(key=lambda x: x[0])
+        del cars_index[vin]
+        cars_index[new_vin] = position
         self._save_index(cars_index, self.cars_index_file)
         
         return self._get_car_by_vin(new_vin)
 
     # Удаление продажи (отмена)
     def revert_sale(self, sales_number: str) -> Car:
-        sales_index = self._load_index(self.sales_index_file)
-        position = None
-        
-        for idx_sales, pos in sales_index:
-            if idx_sales == sales_number:
-                position = pos
-                break
-        
+        position = self._load_index_cached('_sales_idx', self.sales_index_file).get(sales_number)
         if position is None:
             raise ValueError(f"Sale {sales_number} not found")
         
         record = self._read_record(self.sales_file, position)
-        fields = record.split('|', 4)
-        if len(fields) != 5:
+        if not record:
             raise ValueError("Invalid sale format")
         
-        if fields[4].strip() == 'True':
+        fields = self._unpack_fields(record, self.SALE_LAYOUT)
+        if fields[4] == 'True':
             raise ValueError(f"Sale {sales_number} already deleted")
         
+        model_sales = self._load_model_sales()
         fields[4] = 'True'
-        self._write_record(self.sales_file, position, self._format_record('|'.join(fields)))
+        self._write_record(self.sales_file, position, self._format_record_bytes(self._pack_fields(fields, self.SALE_LAYOUT)))
         
-        car_vin = fields[1].strip()
+        car_vin = fields[1]
+        active_sales = self._load_active_sales()
+        if active_sales.get(car_vin) == position:
+            del active_sales[car_vin]
         self._update_car_status(car_vin, CarStatus.available.value)
-        return self._get_car_by_vin(car_vin)
+        car = self._get_car_by_vin(car_vin)
+        positions = model_sales.get(str(car.model))
+        if positions is not None:
+            positions.discard(position)
+            if not positions:
+                del model_sales[str(car.model)]
+        return car
 
     # Самые продаваемые модели
     def top_models_by_sales(self) -> List[ModelSaleStats]:
-        model_sales = defaultdict(int)
-        
-        
-        file_size = os.path.getsize(self.sales_file)
-        if file_size == 0:
-            return []
-        
-        total_records = file_size // self.RECORD_SIZE_WITH_NL
-        for pos in range(total_records):
-            record = self._read_record(self.sales_file, pos)
-            if not record.strip():  
-                continue
-            fields = record.split('|', 4)
-            if len(fields) == 5 and fields[4].strip() == 'False':  
-                car_vin = fields[1].strip()
-                car_data = self._find_car_by_vin(car_vin)
-                if car_data:
-                    c_fields = car_data.split('|', 4)
-                    if len(c_fields) == 5:
-                        model_id = c_fields[1].strip()  
-                        model_sales[model_id] += 1
-                
-        models_index = self._load_index(self.models_index_file)
-        models_data = {}
-        for model_id, pos in models_index:
-            model_record = self._read_record(self.models_file, pos)
-            if model_record.strip():
-                m_fields = model_record.split('|', 2)
-                if len(m_fields) == 3:
-                    name = m_fields[1].strip()
-                    brand = m_fields[2].strip()
-                    models_data[model_id] = (name, brand)
-        
-        sorted_models = sorted(model_sales.items(), key=lambda x: x[1], reverse=True)[:3]
+        # При равном числе продаж выше модель, чья действующая продажа записана раньше,
+        # поэтому порядок не зависит от того, собран индекс заново или вёлся с начала работы
+        sorted_models = heapq.nlargest(
+            3,
+            self._load_model_sales().items(),
+            key=lambda item: (len(item[1]), -min(item[1]))
+        )
         result = []
-        for model_id, sales_count in sorted_models:
-            if model_id in models_data:
-                name, brand = models_data[model_id]
+        for model_id, positions in sorted_models:
+            sales_count = len(positions)
+            if model_id in self._models:
+                name, brand = self._models[model_id]
                 result.append(ModelSaleStats(
                     car_model_name=name,
                     brand=brand,
@@ -293,54 +491,101 @@ class CarService:
 
 
     # Вспомогательные методы
-    def _find_car_by_vin(self, vin: str) -> Optional[str]: # Линейный поиск по индексу
-        for v, pos in self._load_index(self.cars_index_file):
-            if v == vin:
-                return self._read_record(self.cars_file, pos)
-        return None
+    def _find_car_by_vin(self, vin: str) -> Optional[str]: # Поиск позиции по индексу в памяти
+        pos = self._load_index_cached('_cars_idx', self.cars_index_file).get(vin)
+        if pos is None:
+            return None
+        return self._read_record(self.cars_file, pos)
+
 
+    def _load_all_models(self) -> Dict[str, Tuple[str, str]]:
+        models = {}
+        for record in self._iter_records(self.models_file):
+            fields = record.split('|', 2)
+            if len(fields) == 3:
+                models[fields[0].strip()] = (fields[1].strip(), fields[2].strip())
+        return models
 
-    def _find_model_by_id(self, model_id: str) -> Optional[str]:
-        for m, pos in self._load_index(self.models_index_file):
-            if m == model_id:
-                return self._read_record(self.models_file, pos)
-        return None
+
+    def _find_model_by_id(self, model_id: str) -> Optional[Tuple[str, str]]:
+        return self._models.get(model_id)
+
+
+    # Продажи по моделям собираются один раз, дальше их ведут sell_cars и revert_sale
+    def _load_model_sales(self) -> Dict[str, Set[int]]:
+        if self._model_sales is None:
+            vin_to_model = self._load_vin_to_model()
+            model_sales = {}
+            for pos, record in enumerate(self._iter_records(self.sales_file)):
+                if record[self.SALE_DELETED].rstrip() == 'False':
+                    model_id = vin_to_model.get(record[self.SALE_VIN].rstrip())
+                    if model_id is not None:
+                        model_sales.setdefault(model_id, set()).add(pos)
+            self._model_sales = model_sales
+        return self._model_sales
+
+
+    # Соответствие VIN -> id модели за один проход по cars.txt
+    def _load_vin_to_model(self) -> Dict[str, str]:
+        vin_to_model = {}
+        for record in self._iter_records(self.cars_file):
+            vin_to_model[record[self.CAR_VIN].rstrip()] = record[self.CAR_MODEL].rstrip()
+        return vin_to_model
+
+
+    # Действующие продажи собираются одним проходом по sales.txt при первом обращении
+    def _load_active_sales(self) -> Dict[str, int]:
+        if self._active_sale_by_vin is None:
+            active_sales = {}
+            for pos, record in enumerate(self._iter_records(self.sales_file)):
+                if record[self.SALE_DELETED].rstrip() == 'False':
+                    active_sales.setdefault(record[self.SALE_VIN].rstrip(), pos)
+            self._active_sale_by_vin = active_sales
+        return self._active_sale_by_vin
+
+
+    # Распределение машин по статусам собирается одним проходом по cars.txt при первом обращении
+    def _load_cars_by_status(self) -> Dict[str, Set[int]]:
+        if self._cars_by_status is None:
+            cars_by_status = {status.value: set() for status in CarStatus}
+            for pos, record in enumerate(self._iter_records(self.cars_file)):
+                cars_by_status.setdefault(record[self.CAR_STATUS].rstrip(), set()).add(pos)
+            self._cars_by_status = cars_by_status
+        return self._cars_by_status
 
 
     def _find_active_sale_by_vin(self, vin: str) -> Optional[str]:
-        file_size = os.path.getsize(self.sales_file)
-        if file_size == 0:
+        pos = self._load_active_sales().get(vin)
+        if pos is None:
             return None
-        total = file_size // self.RECORD_SIZE_WITH_NL
-        for pos in range(total):
-            record = self._read_record(self.sales_file, pos)
-            fields = record.split('|', 4)
-            if len(fields) == 5 and fields[1].strip() == vin and fields[4].strip() == 'False':
-                return record
-        return None
+        return self._read_record(self.sales_file, pos)
 
 
     def _get_car_by_vin(self, vin: str) -> Car:
         data = self._find_car_by_vin(vin)
         if not data:
             raise ValueError(f"Car {vin} not found")
-        fields = data.split('|', 4)
-        return Car.model_validate({
-            'vin': fields[0].strip(),
-            'model': fields[1].strip(),
-            'price': fields[2].strip(),
-            'date_start': fields[3].strip(),
-            'status': fields[4].strip()
-        })
+        return self._car_from_record(data)
+
+
+    # Данные на диске записаны сервисом и уже проверены, поэтому Car собирается без валидации pydantic
+    def _car_from_record(self, record: str) -> Car:
+        return Car.model_construct(
+            vin=record[self.CAR_VIN].rstrip(),
+            model=int(record[self.CAR_MODEL]),
+            price=Decimal(record[self.CAR_PRICE].rstrip()),
+            date_start=datetime.fromisoformat(record[self.CAR_DATE].rstrip()),
+            status=CarStatus(record[self.CAR_STATUS].rstrip())
+        )
 
 
     def _update_car_status(self, vin: str, status: str):
-        cars_index = self._load_index(self.cars_index_file)
-        for v, pos in cars_index:
-            if v == vin:
-                record = self._read_record(self.cars_file, pos)
-                fields = record.split('|', 4)
-                if len(fields) == 5:
-                    fields[4] = status
-                    self._write_record(self.cars_file, pos, self._format_record('|'.join(fields)))
-                return
+        pos = self._load_index_cached('_cars_idx', self.cars_index_file).get(vin)
+        if pos is None:
+            return
+        fields = self._unpack_fields(self._read_record(self.cars_file, pos), self.CAR_LAYOUT)
+        cars_by_status = self._load_cars_by_status()
+        cars_by_status.get(fields[4], set()).discard(pos)
+        cars_by_status.setdefault(status, set()).add(pos)
+        fields[4] = status
+        self._write_record(self.cars_file, pos, self._format_record_bytes(self._pack_fields(fields, self.CAR_LAYOUT)))
@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 from decimal import Decimal
 
@@ -290,3 +291,296 @@ class TestCarServiceScenarios:
             ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1),
         ]
         assert service.top_models_by_sales() == top_3_models
+
+    def test_reopen_service(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        with CarService(tmpdir) as service:
+            self._fill_initial_data(service, car_data, model_data)
+            service.sell_car(
+                Sale(
+                    sales_number="20240903#KNAGM4A77D5316538",
+                    car_vin="KNAGM4A77D5316538",
+                    sales_date=datetime(2024, 9, 3),
+                    cost=Decimal("2999.99"),
+                )
+            )
+            service.update_vin("5N1CR2MN9EC641864", "UPDR2MN9EC641864X")
+
+        with CarService(tmpdir) as service:
+            available_cars = [
+                car.model_copy(update={"vin": "UPDR2MN9EC641864X"}) if car.vin == "5N1CR2MN9EC641864" else car
+                for car in car_data
+                if car.status == CarStatus.available and car.vin != "KNAGM4A77D5316538"
+            ]
+            assert service.get_cars(CarStatus.available) == available_cars
+
+            assert service.get_car_info("KNAGH4A48A5414970") == CarFullInfo(
+                vin="KNAGH4A48A5414970",
+                car_model_name="Optima",
+                car_model_brand="Kia",
+                price=Decimal("2100"),
+                date_start=datetime(2024, 4, 4),
+                status=CarStatus.available,
+                sales_date=None,
+                sales_cost=None,
+            )
+
+            assert service.get_car_info("5N1CR2MN9EC641864") is None
+            updated = service.get_car_info("UPDR2MN9EC641864X")
+            assert updated is not None
+            assert updated.car_model_name == "Pathfinder"
+
+            sold = service.get_car_info("KNAGM4A77D5316538")
+            assert sold is not None
+            assert sold.status == CarStatus.sold
+            assert sold.sales_cost == Decimal("2999.99")
+
+            car = service.revert_sale("20240903#KNAGM4A77D5316538")
+            assert car.status == CarStatus.available
+
+    def test_batch_insert(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        service.add_models(model_data)
+        service.add_cars(car_data)
+
+        sales = [
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            ),
+            Sale(
+                sales_number="20240903#JM1BL1M58C1614725",
+                car_vin="JM1BL1M58C1614725",
+                sales_date=datetime(2024, 9, 6),
+                cost=Decimal("2334"),
+            ),
+        ]
+        sold_cars = service.sell_cars(sales)
+
+        assert [car.vin for car in sold_cars] == [sale.car_vin for sale in sales]
+        assert all(car.status == CarStatus.sold for car in sold_cars)
+
+        available_cars = [
+            car for car in car_data
+            if car.status == CarStatus.available and car.vin != "KNAGM4A77D5316538"
+        ]
+        assert service.get_cars(CarStatus.available) == available_cars
+        assert service.top_models_by_sales() == [
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1),
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+        ]
+
+    def test_top_models_after_revert(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        service.sell_car(
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            )
+        )
+        service.sell_car(
+            Sale(
+                sales_number="20240903#JM1BL1M58C1614725",
+                car_vin="JM1BL1M58C1614725",
+                sales_date=datetime(2024, 9, 6),
+                cost=Decimal("2334"),
+            )
+        )
+        service.revert_sale("20240903#KNAGM4A77D5316538")
+
+        assert service.top_models_by_sales() == [
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+        ]
+
+    def test_reopen_without_close(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("2999.99"),
+            )
+        )
+
+        reopened = CarService(tmpdir)
+
+        car = reopened.get_car_info("KNAGM4A77D5316538")
+        assert car is not None
+        assert car.status == CarStatus.sold
+
+        car = reopened.revert_sale("20240903#KNAGM4A77D5316538")
+        assert car.status == CarStatus.available
+
+    def test_batch_scope_flushes_indexes(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        with service.batch():
+            self._fill_initial_data(service, car_data, model_data)
+
+        reopened = CarService(tmpdir)
+        assert reopened.get_car_info("KNAGM4A77D5316538") is not None
+
+    def test_reopen_after_file_growth(self, tmpdir: str, model_data: list[Model]):
+        cars = [
+            Car(
+                vin=f"VIN{i:014d}",
+                model=1,
+                price=Decimal("1000"),
+                date_start=datetime(2024, 1, 1),
+                status=CarStatus.available,
+            )
+            for i in range(CarService.GROW_RECORDS + 1)
+        ]
+
+        with CarService(tmpdir) as service:
+            service.add_models(model_data)
+            for car in cars:
+                service.add_car(car)
+
+        assert os.path.getsize(os.path.join(tmpdir, "cars.txt")) == len(cars) * CarService.RECORD_SIZE_WITH_NL
+
+        with CarService(tmpdir) as service:
+            assert service.get_cars(CarStatus.available) == cars
+
+    def test_legacy_text_index_is_rejected(self, tmpdir: str):
+        with open(os.path.join(tmpdir, "cars_index.txt"), "w") as f:
+            f.write("KNAGM4A77D5316538:0\n")
+
+        with pytest.raises(ValueError):
+            CarService(tmpdir)
+
+    def test_delimited_records_are_rejected(self, tmpdir: str):
+        with open(os.path.join(tmpdir, "cars.txt"), "w") as f:
+            f.write("KNAGM4A77D5316538|1|2000|2024-02-08T00:00:00|available".ljust(500) + "\n")
+
+        with pytest.raises(ValueError):
+            CarService(tmpdir)
+
+        assert os.path.getsize(os.path.join(tmpdir, "cars.txt")) == CarService.RECORD_SIZE_WITH_NL
+
+    def test_field_too_wide(self, tmpdir: str, model_data: list[Model]):
+        service = CarService(tmpdir)
+        service.add_models(model_data)
+
+        too_long_vin = Car(
+            vin="KNAGM4A77D5316538X",
+            model=1,
+            price=Decimal("2000"),
+            date_start=datetime(2024, 2, 8),
+            status=CarStatus.available,
+        )
+        too_long_price = Car(
+            vin="KNAGM4A77D5316538",
+            model=1,
+            price=Decimal("12345678901234567890.5"),
+            date_start=datetime(2024, 2, 8),
+            status=CarStatus.available,
+        )
+
+        with pytest.raises(ValueError):
+            service.add_car(too_long_vin)
+        with pytest.raises(ValueError):
+            service.add_car(too_long_price)
+
+        assert service.get_cars(CarStatus.available) == []
+        assert service.get_car_info("KNAGM4A77D5316538") is None
+
+    def test_record_too_long(self, tmpdir: str, model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        with pytest.raises(ValueError):
+            service.add_models([*model_data, Model(id=6, name="Я" * 260, brand="Lada")])
+
+        assert os.path.getsize(os.path.join(tmpdir, "models.txt")) == 0
+
+        service.add_models(model_data)
+        with CarService(tmpdir) as reopened:
+            reopened.add_car(
+                Car(
+                    vin="KNAGM4A77D5316538",
+                    model=1,
+                    price=Decimal("2000"),
+                    date_start=datetime(2024, 2, 8),
+                    status=CarStatus.available,
+                )
+            )
+            info = reopened.get_car_info("KNAGM4A77D5316538")
+            assert info is not None
+            assert info.car_model_name == "Optima"
+
+    def test_sell_cars_with_unknown_vin(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        sales = [
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            ),
+            Sale(
+                sales_number="20240903#UNKNOWN0000000000",
+                car_vin="UNKNOWN0000000000",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1000"),
+            ),
+        ]
+
+        with pytest.raises(ValueError):
+            service.sell_cars(sales)
+
+        car = service.get_car_info("KNAGM4A77D5316538")
+        assert car is not None
+        assert car.status == CarStatus.available
+        assert service.top_models_by_sales() == []
+        assert CarService(tmpdir).top_models_by_sales() == []
+
+    def test_top_models_tie_after_revert_and_resell(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        service.sell_car(
+            Sale(
+                sales_number="20240903#KNAGM4A77D5316538",
+                car_vin="KNAGM4A77D5316538",
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("1999.09"),
+            )
+        )
+        service.sell_car(
+            Sale(
+                sales_number="20240903#JM1BL1M58C1614725",
+                car_vin="JM1BL1M58C1614725",
+                sales_date=datetime(2024, 9, 4),
+                cost=Decimal("2334"),
+            )
+        )
+        service.revert_sale("20240903#KNAGM4A77D5316538")
+        service.sell_car(
+            Sale(
+                sales_number="20240905#KNAGH4A48A5414970",
+                car_vin="KNAGH4A48A5414970",
+                sales_date=datetime(2024, 9, 5),
+                cost=Decimal("2100"),
+            )
+        )
+
+        top_models = [
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1),
+        ]
+        assert service.top_models_by_sales() == top_models
+        assert CarService(tmpdir).top_models_by_sales() == top_models